@@ -1,12 +1,20 @@
 import streamlit as st
-import tempfile
 import os
 import json
 from dotenv import load_dotenv
 import keys  # Ensure this module contains your OpenAI API key as `key`
-import llm  # Ensure this module contains the QueryRunner class
+import config
 import datetime  # For timestamping saved files
 import agents  # Import your prompts from agents.py
+import time  # For job wait timers
+import uuid  # For anonymous student IDs
+import io  # For the class reports archive
+import zipfile  # For the class reports archive
+import leitner  # Leitner-box review scheduler
+import scorehistory  # Rolling per-student score aggregates
+import reports  # Background PDF report rendering
+import metacognition  # Concurrent teacher/student recommendations
+import jobs  # Background job queue for agent calls
 
 # Load environment variables if needed
 load_dotenv()
@@ -32,6 +40,10 @@ APP_TITLE = "Learnify"
 ANSWERS_SUBMITTED_MESSAGE = "✅ Your answers have been submitted and saved!"
 STUDENT_SCORED_MESSAGE = "✅ Your performance has been evaluated!"
 METACOGNITIVE_SUCCESS_MESSAGE = "✅ Personalized recommendations generated successfully!"
+AUDIENCE_LABELS = {
+    "teacher": "👩‍🏫 For the Teacher",
+    "student": "🎓 For the Student"
+}
 
 # Taxonomy Level Descriptions
 tax_lev_dic = {
@@ -85,16 +97,29 @@ if 'answers_submitted' not in st.session_state:
     st.session_state['answers_submitted'] = False
 if 'scored_data' not in st.session_state:
     st.session_state['scored_data'] = None
+if 'scored_job_id' not in st.session_state:
+    st.session_state['scored_job_id'] = None  # Identifies the scored submission for Leitner / history
 if 'scored_filename' not in st.session_state:
     st.session_state['scored_filename'] = None
 if 'weights' not in st.session_state:
     st.session_state['weights'] = {}
 if 'recommendations' not in st.session_state:
-    st.session_state['recommendations'] = None
+    st.session_state['recommendations'] = None  # {audience: recommendations}
 if 'taxonomy_evaluation' not in st.session_state:
     st.session_state['taxonomy_evaluation'] = None  # New entry for Taxonomy-Based Evaluation
 if 'selected_language' not in st.session_state:
     st.session_state['selected_language'] = 'English'  # Default language
+if 'jobs' not in st.session_state:
+    st.session_state['jobs'] = {}  # Background job IDs: reruns attach to them instead of resubmitting
+if 'class_report_keys' not in st.session_state:
+    st.session_state['class_report_keys'] = None  # Report hash -> student of the last class export
+if 'class_report_zip' not in st.session_state:
+    st.session_state['class_report_zip'] = None  # Archive of the last class export, built once
+if 'report_key' not in st.session_state:
+    st.session_state['report_key'] = None  # Hash of the last requested PDF report
+if 'student_id' not in st.session_state:
+    # Unique per session until the student enters their own ID, so anonymous sessions never share a profile
+    st.session_state['student_id'] = f"student-{uuid.uuid4().hex[:8]}"
 
 
 # Define Taxonomy Levels
@@ -142,44 +167,65 @@ def upload_file():
         st.info("👉 Please upload a `.txt` file to get started.")
         return False
 
+# Attach to a Background Job (waits while the script runs; a rerun simply attaches again)
+def attach_job(job_id, waiting_message):
+    job_queue = jobs.get_queue()
+    job = job_queue.get(job_id)
+    cancel_box = st.empty()
+    status_box = st.empty()
+    if job is not None and job['status'] in jobs.ACTIVE:
+        if cancel_box.button('✖ Cancel', key=f"cancel_{job_id}"):
+            job_queue.cancel(job_id)
+    while job is not None and job['status'] in jobs.ACTIVE:
+        status_box.info(f"⏳ {waiting_message} ({time.time() - job['created']:.0f}s)")
+        job = job_queue.wait(job_id, config.JOB_POLL_SECONDS)
+    cancel_box.empty()
+    status_box.empty()
+    return job
+
+# Display the Error of an Unsuccessful Job
+def display_job_error(job, parse_error_message, default_message):
+    if job is None:
+        st.error(default_message)
+    elif job['status'] == jobs.CANCELLED:
+        st.warning("🛑 The request was cancelled.")
+    elif job['status'] == jobs.TIMEOUT:
+        st.error("⌛ The request took too long. Please try again.")
+    elif job['error_type'] == "JSONDecodeError":
+        st.error(parse_error_message)
+    elif job['error_type'] == "EmptyResponseError":
+        st.error("No response from the language model.")
+    else:
+        st.error(default_message)
+
 # Run LLM Query for Taxonomy Agent
 def run_llm_query(TAXONOMY_AGENT_PROMPT):
     MODEL_NAME = "gpt-3.5-turbo"  # or "gpt-4", etc.
     file_content = st.session_state['file_content']
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8', suffix=".txt") as tmp_file:
-        tmp_file.write(file_content)
-        temp_file_path = tmp_file.name
 
-    try:
-        bloom_taxonomy_agent = llm.QueryRunner(document_path=temp_file_path, model_name=MODEL_NAME)
-        bloom_taxonomy = bloom_taxonomy_agent.run_query(TAXONOMY_AGENT_PROMPT)
-        result_str = bloom_taxonomy.get('result', '').strip()
-
-        if result_str:
-            # Remove code block markers if present
-            if result_str.startswith("```json") and result_str.endswith("```"):
-                result_str = result_str[7:-3].strip()
-            elif result_str.startswith("```") and result_str.endswith("```"):
-                result_str = result_str[3:-3].strip()
-
-            # Try parsing the JSON
-            try:
-                json_response = json.loads(result_str)
-                st.session_state['transformed_questions'] = json_response.get("Topic Questions", [])
-                return True
-            except json.JSONDecodeError:
-                st.error("An error occurred while processing your questions. Please try again.")
-                return False
-        else:
-            st.error("No response from the language model.")
-            return False
-    except Exception:
-        st.error("An unexpected error occurred. Please try again.")
+    job_queue = jobs.get_queue()
+    # A cancelled generation is only restarted on request
+    previous_job = job_queue.get(st.session_state['jobs']['taxonomy']) if st.session_state['jobs'].get('taxonomy') else None
+    if previous_job is not None and previous_job['status'] == jobs.CANCELLED and not st.button('🔁 Try Again'):
+        st.warning("🛑 The request was cancelled.")
         return False
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+
+    # Same file, prompt and model give the same job: reruns, refreshes and other students attach to it
+    job_id = job_queue.submit("taxonomy", {
+        "file_content": file_content,
+        "prompt": TAXONOMY_AGENT_PROMPT,
+        "model_name": MODEL_NAME
+    })
+    st.session_state['jobs']['taxonomy'] = job_id
+
+    job = attach_job(job_id, "Transforming your questions...")
+    if job is not None and job['status'] == jobs.DONE:
+        st.session_state['transformed_questions'] = job['result']
+        return True
+    display_job_error(job, "An error occurred while processing your questions. Please try again.",
+                      "An unexpected error occurred. Please try again.")
+    return False
+
 tax_lev_dic = {
     "Remember": "🔍 **Recall what you've learned**",
     "Understand": "💡 **Make sense of the idea**",
@@ -298,58 +344,36 @@ def save_json_file(data, filename_prefix):
         st.error("Failed to save your data.")
         return None
 
-# Run LLM Query for Scoring Agent
-def run_scoring_agent():
+# Submit the Scoring Agent Job
+def submit_scoring_job():
     MODEL_NAME = "gpt-3.5-turbo"  # or "gpt-4", etc.
+    st.session_state['jobs']['scoring'] = jobs.get_queue().submit("scoring", {
+        "restructured_data": st.session_state['restructured_data'],
+        "model_name": MODEL_NAME
+    })
 
-    restructured_data = st.session_state['restructured_data']
-    # Convert restructured_data to JSON string
-    input_json = json.dumps(restructured_data, ensure_ascii=False, indent=4)
-
-    # Prepare the prompt with the input JSON
-    scoring_prompt = SCORING_AGENT_PROMPT.replace("{input_json}", input_json)
-
-    # Write the input JSON to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8', suffix=".json") as tmp_file:
-        tmp_file.write(input_json)
-        temp_file_path = tmp_file.name
-
-    try:
-        scoring_agent = llm.QueryRunner(document_path=temp_file_path, model_name=MODEL_NAME)
-        scoring_response = scoring_agent.run_query(scoring_prompt)
-        result_str = scoring_response.get('result', '').strip()
-
-        if result_str:
-            # Remove code block markers if present
-            if result_str.startswith("```json") and result_str.endswith("```"):
-                result_str = result_str[7:-3].strip()
-            elif result_str.startswith("```") and result_str.endswith("```"):
-                result_str = result_str[3:-3].strip()
-
-            # Try parsing the JSON
-            try:
-                scored_data = json.loads(result_str)
-                st.session_state['scored_data'] = scored_data  # Store in session state
-                return True
-            except json.JSONDecodeError:
-                st.error("An error occurred while evaluating your performance.")
-                return False
-        else:
-            st.error("No response from the language model.")
-            return False
-
-    except Exception:
-        st.error("An unexpected error occurred during evaluation.")
-        return False
+# Run LLM Query for Scoring Agent (attaches to the submitted job)
+def run_scoring_agent():
+    job = attach_job(st.session_state['jobs']['scoring'], "Evaluating your answers...")
+    # The job is consumed once, so its result is only processed a single time
+    del st.session_state['jobs']['scoring']
 
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+    if job is not None and job['status'] == jobs.DONE:
+        st.session_state['scored_data'] = job['result']  # Store in session state
+        st.session_state['scored_job_id'] = job['id']
+        return True
+    display_job_error(job, "An error occurred while evaluating your performance.",
+                      "An unexpected error occurred during evaluation.")
+    return False
 
 # Calculate Taxonomy-Based Evaluation and Store JSON
 def calculate_taxonomy_evaluation():
-    scored_data = st.session_state['scored_data']
+    taxonomy_evaluation = evaluate_scores(st.session_state['scored_data'], st.session_state['weights'])
+    st.session_state['taxonomy_evaluation'] = taxonomy_evaluation
+    return taxonomy_evaluation
+
+# Taxonomy-Based Evaluation of a Scored Submission with the given Weights
+def evaluate_scores(scored_data, weights):
     taxonomy_evaluation = {"Bloom Taxonomy": {}}
 
     for level in taxonomy_levels:
@@ -361,7 +385,7 @@ def calculate_taxonomy_evaluation():
                 total_score += score
                 count += 1
             average_score = total_score / count if count > 0 else 0
-            weight = st.session_state['weights'].get(level, 0)
+            weight = weights.get(level, 0)
             weighted_average = average_score * weight
             taxonomy_evaluation["Bloom Taxonomy"][level] = {
                 "average_score": average_score,
@@ -371,15 +395,14 @@ def calculate_taxonomy_evaluation():
         else:
             taxonomy_evaluation["Bloom Taxonomy"][level] = {
                 "average_score": 0,
-                "weight": st.session_state['weights'].get(level, 0),
+                "weight": weights.get(level, 0),
                 "weighted_average": 0
             }
 
-    st.session_state['taxonomy_evaluation'] = taxonomy_evaluation
     return taxonomy_evaluation
 
-# Run LLM Query for Metacognitive Recommendation Agent
-def run_metacognition_agent():
+# Submit the Metacognitive Recommendation Jobs (one per audience)
+def submit_metacognition_jobs():
     MODEL_NAME = "gpt-3.5-turbo"  # or "gpt-4", etc.
 
     # Retrieve the Taxonomy-Based Evaluation from session state
@@ -389,41 +412,75 @@ def run_metacognition_agent():
         st.error("Evaluation data is missing.")
         return False
 
-    # Convert the taxonomy_evaluation to a JSON string
-    input_json_str = json.dumps(taxonomy_evaluation, ensure_ascii=False, indent=4)
-
-    # Prepare the prompt with the input JSON
-    metacognition_prompt = METACOGNITION_AGENT_PROMPT.replace("{input_json}", input_json_str)
-
-    # Write the prompt to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8', suffix=".txt") as tmp_file:
-        tmp_file.write(metacognition_prompt)
-        temp_file_path = tmp_file.name
-
-    try:
-        # Initialize QueryRunner with document_path and model_name
-        metacognition_agent = llm.QueryRunner(document_path=temp_file_path, model_name=MODEL_NAME)
-
-        # Run the query
-        metacognition_response = metacognition_agent.run_query(metacognition_prompt)
-        result_str = metacognition_response.get('result', '').strip()
-
-        if result_str:
-            # Store the recommendations
-            st.session_state['recommendations'] = result_str
-            return True
-        else:
-            st.error("No response from the language model.")
-            return False
+    # Add the student's Leitner boxes and due reviews so the model does not have to improvise them
+    scheduler = leitner.get_scheduler()
+    metacognition_input = dict(taxonomy_evaluation)
+    metacognition_input["Leitner Review"] = scheduler.summary(st.session_state['student_id'])
+    # Longitudinal progress, so recommendations are not based on this single snapshot
+    metacognition_input["Score History"] = scorehistory.get_history().progress_summary(st.session_state['student_id'])
 
-    except Exception:
-        st.error("An unexpected error occurred while generating recommendations.")
-        return False
+    # Convert the taxonomy_evaluation to a JSON string
+    input_json_str = json.dumps(metacognition_input, ensure_ascii=False, indent=4)
+
+    # Teacher and student variants run as separate jobs, concurrently
+    job_queue = jobs.get_queue()
+    st.session_state['jobs']['recommendation'] = {
+        audience: job_queue.submit("recommendation", {
+            "audience": audience,
+            "input_json": input_json_str,
+            "model_name": MODEL_NAME
+        })
+        for audience in metacognition.AUDIENCE_PROMPTS
+    }
+    return True
 
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+# Run LLM Query for Metacognitive Recommendation Agent (attaches to the submitted jobs)
+def run_metacognition_agent():
+    job_queue = jobs.get_queue()
+    pending = dict(st.session_state['jobs']['recommendation'])
+
+    # Each audience is shown as soon as its job completes
+    cancel_box = st.empty()
+    if cancel_box.button('✖ Cancel', key=f"cancel_{'_'.join(pending.values())}"):
+        for job_id in pending.values():
+            job_queue.cancel(job_id)
+    placeholders = {audience: st.empty() for audience in pending}
+
+    recommendations = {}
+    while pending:
+        for audience, job_id in list(pending.items()):
+            job = job_queue.get(job_id)
+            if job is not None and job['status'] in jobs.ACTIVE:
+                placeholders[audience].info(f"⏳ Preparing recommendations {AUDIENCE_LABELS[audience].lower()} "
+                                            f"({time.time() - job['created']:.0f}s)")
+                continue
+            del pending[audience]
+            if job is not None and job['status'] == jobs.DONE and job['result']:
+                recommendations[audience] = job['result']
+                with placeholders[audience].container():
+                    st.markdown(f"#### {AUDIENCE_LABELS[audience]}")
+                    st.write(job['result'])
+            elif job is not None and job['status'] == jobs.DONE:
+                placeholders[audience].error("No response from the language model.")
+            else:
+                with placeholders[audience].container():
+                    display_job_error(job, "An unexpected error occurred while generating recommendations.",
+                                      "An unexpected error occurred while generating recommendations.")
+        if pending:
+            job_queue.wait(next(iter(pending.values())), config.JOB_POLL_SECONDS)
+    cancel_box.empty()
+    # The jobs are consumed once, so their results are only processed a single time
+    del st.session_state['jobs']['recommendation']
+
+    if recommendations:
+        # The final recommendations are displayed by display_metacognitive_recommendations;
+        # the error of an audience that failed stays visible
+        for audience in recommendations:
+            placeholders[audience].empty()
+        # Store the recommendations
+        st.session_state['recommendations'] = recommendations
+    # Success only when every audience got its recommendations
+    return len(recommendations) == len(placeholders)
 
 # Display Taxonomy-Based Evaluation
 def display_taxonomy_based_evaluation():
@@ -471,21 +528,118 @@ def display_taxonomy_based_evaluation():
 def display_metacognitive_recommendations():
     recommendations = st.session_state['recommendations']
     st.markdown("### Metacognitive Recommendations")
-    st.write(recommendations)
-
-    # Optionally, save the recommendations to a file
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"metacognitive_recommendations_{timestamp}.txt"
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(recommendations)
-
-    # Download button for recommendations
-    st.download_button(
-        label="📥 Download Recommendations",
-        data=recommendations,
-        file_name=filename,
-        mime='text/plain'
-    )
+    tabs = st.tabs([AUDIENCE_LABELS[audience] for audience in recommendations])
+    for tab, (audience, text) in zip(tabs, recommendations.items()):
+        with tab:
+            st.write(text)
+
+            # Optionally, save the recommendations to a file (named by content, so reruns do not rewrite it)
+            filename = f"metacognitive_recommendations_{audience}_{reports.report_key('', None, text)[:16]}.txt"
+            if not os.path.exists(filename):
+                with open(filename, 'w', encoding='utf-8') as f:
+                    f.write(text)
+
+            # Download button for recommendations
+            st.download_button(
+                label="📥 Download Recommendations",
+                data=text,
+                file_name=filename,
+                mime='text/plain',
+                key=f"download_recommendations_{audience}"
+            )
+
+# Wait for Background Reports (polls automatically; a rerun simply waits again)
+def wait_for_reports(keys, status_box):
+    renderer = reports.get_renderer()
+    while True:
+        pending = [key for key in keys if renderer.status(key) == "pending"]
+        if not pending:
+            break
+        status_box.info(f"⏳ Preparing reports... {len(keys) - len(pending)}/{len(keys)} ready")
+        renderer.wait(pending, config.JOB_POLL_SECONDS)
+    status_box.empty()
+
+# PDF Report Export (rendered in the background, the UI only polls for the finished file)
+def display_report_export():
+    st.markdown("### Export Your Progress Report")
+    renderer = reports.get_renderer()
+    if st.button('📄 Generate PDF Report'):
+        st.session_state['report_key'] = renderer.submit(
+            st.session_state['student_id'],
+            st.session_state['taxonomy_evaluation'],
+            st.session_state.get('recommendations')
+        )
+
+    report_key = st.session_state.get('report_key')
+    if not report_key:
+        return
+    wait_for_reports([report_key], st.empty())
+    if renderer.status(report_key) == "done":
+        with open(renderer.path(report_key), 'rb') as f:
+            st.download_button(
+                label="📥 Download PDF Report",
+                data=f.read(),
+                file_name=f"learnify_report_{st.session_state['student_id']}.pdf",
+                mime='application/pdf'
+            )
+    else:
+        st.error("Failed to generate your report. Please try again.")
+
+# Class PDF Export for Teachers (one report per scored submission file, rendered in the background)
+def display_class_export():
+    with st.sidebar.expander("📚 Class Report Export"):
+        scored_files = st.file_uploader("Scored submissions (`student_score_*.json`)", type=["json"],
+                                        accept_multiple_files=True, key="class_export_files")
+        if st.button('📄 Generate Class Reports') and scored_files:
+            weights = st.session_state['weights'] or dict(zip(taxonomy_levels, [1/6]*6))
+            class_reports = []
+            for scored_file in scored_files:
+                try:
+                    scored_data = json.loads(scored_file.getvalue().decode("utf-8"))
+                    student = os.path.splitext(scored_file.name)[0]
+                    class_reports.append((student, evaluate_scores(scored_data, weights), None))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # ValueError covers both invalid JSON and a file that is not utf-8
+                    st.error(f"❌ {scored_file.name} is not a scored submission.")
+            keys = reports.get_renderer().submit_class(class_reports)
+            st.session_state['class_report_keys'] = dict(zip(keys, [student for student, _, _ in class_reports]))
+            st.session_state['class_report_zip'] = None
+
+        if st.session_state['class_report_zip'] is not None:
+            for student in st.session_state.get('class_report_failed', []):
+                st.error(f"Failed to generate the report of {student}.")
+            st.download_button(
+                label="📥 Download Class Reports",
+                data=st.session_state['class_report_zip'],
+                file_name="learnify_class_reports.zip",
+                mime='application/zip'
+            )
+        elif st.session_state['class_report_keys']:
+            # Only this fragment reruns while the reports render: the main page keeps working
+            st.fragment(display_class_export_progress, run_every=config.JOB_POLL_SECONDS)()
+
+# Progress of the Class Export, checked without blocking; the archive is built once, when all are finished
+def display_class_export_progress():
+    renderer = reports.get_renderer()
+    class_report_keys = st.session_state['class_report_keys']
+    statuses = {key: renderer.status(key) for key in class_report_keys}
+    pending = sum(status == "pending" for status in statuses.values())
+    if pending:
+        st.info(f"⏳ Preparing reports... {len(statuses) - pending}/{len(statuses)} ready")
+        return
+
+    archive = io.BytesIO()
+    failed = []
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        for key, student in class_report_keys.items():
+            if statuses[key] == "done":
+                zip_file.write(renderer.path(key), f"learnify_report_{student}.pdf")
+            else:
+                failed.append(student)
+    st.session_state['class_report_failed'] = failed
+    st.session_state['class_report_zip'] = archive.getvalue()
+    # Full rerun: shows the download button and stops the polling
+    st.rerun()
 
     
 def main():
@@ -499,6 +653,14 @@ def main():
         index=language_options.index(st.session_state.get('selected_language', 'English'))
     )
     st.session_state['selected_language'] = selected_language
+
+    # Student identification for the review schedule
+    student_id = st.sidebar.text_input("Student ID", value=st.session_state['student_id']).strip()
+    if student_id:
+        st.session_state['student_id'] = student_id
+
+    # Teachers can export a whole class at any time; rendering is polled in a fragment, not here
+    display_class_export()
     
     # Step 1: File upload
     if st.session_state['file_content'] is None:
@@ -535,12 +697,26 @@ def main():
     st.markdown("### Reflect on Your Learning Journey!")
     score_button = st.button('🎯 Score My Performance 🎯')
     if score_button:
+        submit_scoring_job()
+    # A rerun while scoring is in flight attaches to the same job instead of resubmitting it
+    if st.session_state['jobs'].get('scoring'):
         if run_scoring_agent():
             scored_filename = save_json_file(st.session_state['scored_data'], "student_score")
             st.session_state['scored_filename'] = scored_filename
             st.success(STUDENT_SCORED_MESSAGE)
             # Calculate taxonomy evaluation
             calculate_taxonomy_evaluation()
+            # Move each (question, level) item between Leitner boxes
+            scheduler = leitner.get_scheduler()
+            # Keyed on the scoring job: re-scoring the same answers reuses that job and is not recorded twice
+            scheduler.record_evaluation(st.session_state['student_id'], st.session_state['scored_data'],
+                                        st.session_state['scored_job_id'])
+            scheduler.save(config.LEITNER_STATE_DIR, st.session_state['student_id'])
+            # Update the student's rolling per-level aggregates
+            history = scorehistory.get_history()
+            history.record_submission(st.session_state['student_id'], st.session_state['scored_data'],
+                                      st.session_state['scored_job_id'])
+            history.save(config.SCORE_HISTORY_DIR, st.session_state['student_id'])
 
     if st.session_state.get('scored_data'):
         # Display Scored Data
@@ -550,12 +726,17 @@ def main():
         st.markdown("### Get Personalized Recommendations")
         recommend_button = st.button('✨ Get Recommendations')
         if recommend_button:
+            submit_metacognition_jobs()
+        if st.session_state['jobs'].get('recommendation'):
             if run_metacognition_agent():
                 st.success(METACOGNITIVE_SUCCESS_MESSAGE)
 
         if st.session_state.get('recommendations'):
             display_metacognitive_recommendations()
 
+        # Step 7: PDF Report
+        display_report_export()
+
     # Sidebar Configuration for Weights
     st.sidebar.header("Configuration")
     st.sidebar.subheader("Set Importance Levels")
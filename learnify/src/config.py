@@ -1,12 +1,47 @@
 
 # Document-related parameters
-DOCUMENT_PATH = '../data/exos.txt'
+DOCUMENT_PATH = '../data/physics/exo.txt'  # corpus indexed by the FastAPI service
 ENCODING = "utf-8"
 MAX_TOKENS = 500
 
 # Model-related parameters
 MODEL_NAME = "gpt-3.5-turbo"
 EMBEDDING_TYPE = "cl100k_base" 
+REQUEST_TIMEOUT = 60  # seconds per OpenAI request; (REQUEST_RETRIES + 1) * REQUEST_TIMEOUT stays below JOB_TIMEOUT
+REQUEST_RETRIES = 2
 
 # Search and retrieval-related parameters
-TOP_N_CHUNKS = 3
\ No newline at end of file
+TOP_N_CHUNKS = 3
+INDEX_PATH = '../data/physics/exo.idx'  # memory-mapped index shared by all workers
+INDEX_QUANTIZATION = "int8"  # "int8", "float16" or None for full-precision search
+RERANK_FACTOR = 4  # candidates re-ranked in full precision = TOP_N_CHUNKS * RERANK_FACTOR
+
+# Taxonomy generation parameters
+TAXONOMY_GROUP_TOKENS = MAX_TOKENS  # one group fits in a single retrieved chunk
+TAXONOMY_WORKERS = 8
+
+# Leitner review scheduler parameters
+LEITNER_BOX_INTERVALS = [1, 2, 4, 8, 16]  # days before the next review, per box
+LEITNER_STATE_DIR = 'leitner_state'  # one JSON file per student
+
+# Score history parameters
+SCORE_EMA_ALPHA = 0.3  # weight of the newest submission in the decayed mean and trend
+SCORE_HISTORY_DIR = 'score_history'  # one JSON file per student
+
+# Report rendering parameters
+REPORTS_DIR = 'reports'
+REPORT_WORKERS = 2
+
+# Near-duplicate chunk detection parameters
+DEDUP_THRESHOLD = 0.8  # estimated Jaccard similarity above which two chunks are merged
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_SHINGLE_SIZE = 3  # words per shingle
+
+# Background job queue parameters
+JOBS_DB_PATH = 'jobs.sqlite3'
+JOB_WORKERS = 4
+JOB_TIMEOUT = 300  # seconds before a running agent call is abandoned
+JOB_QUEUE_TIMEOUT = 600  # seconds a job may wait for a free worker
+JOB_POLL_SECONDS = 1.0
+JOB_RETENTION_DAYS = 7  # finished jobs older than this are purged at startup
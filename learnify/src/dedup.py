@@ -0,0 +1,88 @@
+import hashlib
+import re
+
+import numpy as np
+
+import config
+
+
+## ------------------ Near-duplicate chunk detection --------------###
+#
+# Runs between DocumentManager.split_text and embedding. Exact copies are caught by hashing the
+# normalized text; near copies by MinHash signatures over word shingles, bucketed with LSH bands so
+# only chunks sharing a band are compared. Each group of duplicates is embedded once and keeps the
+# list of every (source, position) it came from.
+
+MERSENNE_PRIME = (1 << 32) - 5
+
+
+def normalize(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def shingles(text, size=config.DEDUP_SHINGLE_SIZE):
+    words = normalize(text).split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm=config.DEDUP_NUM_PERM, seed=0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        #### ------- min over shingles of (a * h + b) mod p, one value per permutation -------###
+        hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                           for shingle in shingles(text)], dtype=np.uint64)
+        # a and h are both < 2**32, so the product fits in uint64
+        permuted = (np.outer(hashes, self.a) % MERSENNE_PRIME + self.b) % MERSENNE_PRIME
+        return permuted.min(axis=0)
+
+
+def deduplicate(chunks, sources=None, threshold=config.DEDUP_THRESHOLD, bands=config.DEDUP_BANDS):
+    #### ------- Returns (unique chunks, references) where references[i] lists the (source, position) of every copy -------###
+    sources = sources if sources is not None else [None] * len(chunks)
+    hasher = MinHasher()
+    rows = len(hasher.a) // bands
+
+    unique = []
+    references = []
+    signatures = []
+    exact = {}     # normalized text hash -> unique index
+    buckets = {}   # (band, band signature) -> unique indexes
+
+    for position, (chunk, source) in enumerate(zip(chunks, sources)):
+        reference = (source, position)
+        text_hash = hashlib.sha1(normalize(chunk).encode("utf-8")).hexdigest()
+        if text_hash in exact:
+            references[exact[text_hash]].append(reference)
+            continue
+
+        signature = hasher.signature(chunk)
+        band_keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+        match = None
+        candidates = {index for key in band_keys for index in buckets.get(key, ())}
+        for index in sorted(candidates):
+            # Fraction of equal MinHash values estimates the Jaccard similarity of the shingle sets
+            if np.mean(signatures[index] == signature) >= threshold:
+                match = index
+                break
+
+        if match is not None:
+            references[match].append(reference)
+            exact[text_hash] = match
+            continue
+
+        index = len(unique)
+        unique.append(chunk)
+        references.append([reference])
+        signatures.append(signature)
+        exact[text_hash] = index
+        for key in band_keys:
+            buckets.setdefault(key, []).append(index)
+
+    return unique, references
@@ -0,0 +1,210 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+import metacognition
+import scoring
+import singleflight
+import taxonomy
+
+
+## ------------------ Background job queue for agent calls --------------###
+#
+# Agent calls run on worker threads owned by the process, not by a Streamlit script run, so a
+# widget interaction or page reload no longer abandons them. Jobs live in a local SQLite file:
+# a session only keeps job IDs, reruns attach to the running job, and a job submitted again with
+# the same key (same inputs) attaches to the queued/running/finished one instead of paying for a
+# second call. Finished results therefore survive browser refreshes and app restarts.
+#
+# Timeouts and cancellation cannot interrupt an HTTP call already in progress: the job is marked
+# "timeout" / "cancelled" right away and whatever the call returns later is discarded. The OpenAI
+# clients carry their own request timeout (llm.make_chat), so the worker itself is freed shortly after.
+# Jobs still waiting for a worker JOB_QUEUE_TIMEOUT after they were (re)queued are timed out as well.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+ACTIVE = (QUEUED, RUNNING)
+FINISHED = (DONE, FAILED, CANCELLED, TIMEOUT)
+EMPTY_RESULTS = ('""', "[]", "{}", "null")
+
+
+def run_taxonomy_job(payload):
+    generator = taxonomy.TaxonomyGenerator(model_name=payload["model_name"])
+    return generator.generate(payload["file_content"], payload["prompt"])
+
+
+def run_scoring_job(payload):
+    return scoring.score_answers(payload["restructured_data"], payload["model_name"])
+
+
+def run_recommendation_job(payload):
+    return metacognition.generate(payload["audience"], payload["input_json"], payload["model_name"])
+
+
+HANDLERS = {
+    "taxonomy": run_taxonomy_job,
+    "scoring": run_scoring_job,
+    "recommendation": run_recommendation_job,
+}
+
+
+class JobQueue:
+    def __init__(self, db_path=config.JOBS_DB_PATH, workers=config.JOB_WORKERS, handlers=HANDLERS):
+        self.handlers = handlers
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, kind TEXT, key TEXT, status TEXT, payload TEXT, result TEXT,
+                error TEXT, error_type TEXT, timeout REAL, created REAL, queued REAL, started REAL, finished REAL
+            )""")
+        # Databases created before the queued-since column get it added
+        if "queued" not in [column["name"] for column in self.db.execute("PRAGMA table_info(jobs)")]:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN queued REAL")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+
+        with self.lock:
+            # Work interrupted by a restart is queued again, with a fresh queue timeout; old finished jobs are dropped
+            self.db.execute("UPDATE jobs SET status = ?, started = NULL, queued = ? WHERE status = ?",
+                            (QUEUED, time.time(), RUNNING))
+            self.db.execute("DELETE FROM jobs WHERE status IN (?, ?, ?, ?) AND finished < ?",
+                            FINISHED + (time.time() - config.JOB_RETENTION_DAYS * 24 * 60 * 60,))
+
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        self.threads.append(threading.Thread(target=self._watch_timeouts, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, kind, payload, key=None, timeout=config.JOB_TIMEOUT):
+        #### ------- Queues a job, or returns the ID of the active/finished job with the same key -------###
+        key = key or singleflight.make_key(kind, json.dumps(payload, sort_keys=True, ensure_ascii=False))
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?, ?) "
+                    "AND (result IS NULL OR result NOT IN (?, ?, ?, ?)) ORDER BY created DESC LIMIT 1",
+                    (key, QUEUED, RUNNING, DONE) + EMPTY_RESULTS).fetchone()
+                if row is not None:
+                    job_id = row["id"]
+                else:
+                    job_id = uuid.uuid4().hex
+                    now = time.time()
+                    self.db.execute(
+                        "INSERT INTO jobs (id, kind, key, status, payload, timeout, created, queued) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, kind, key, QUEUED, json.dumps(payload, ensure_ascii=False), timeout, now, now))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self.changed.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        #### ------- Job status, with its decoded result once done -------###
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = None
+        job["result"] = json.loads(row["result"]) if row["result"] is not None else None
+        return job
+
+    def wait(self, job_id, timeout):
+        #### ------- Blocks until the job finishes or `timeout` seconds pass, then returns it -------###
+        deadline = time.time() + timeout
+        job = self.get(job_id)
+        while job is not None and job["status"] in ACTIVE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            with self.changed:
+                # Bounded wait: another process sharing the database cannot notify us
+                self.changed.wait(min(remaining, config.JOB_POLL_SECONDS))
+            job = self.get(job_id)
+        return job
+
+    def cancel(self, job_id):
+        return self._finish(job_id, CANCELLED, error="Cancelled.", only_from=ACTIVE)
+
+    def _finish(self, job_id, status, result=None, error=None, error_type=None, only_from=(RUNNING,)):
+        # A job is finished once: late results of timed-out or cancelled jobs are discarded
+        with self.lock:
+            placeholders = ", ".join("?" for _ in only_from)
+            cursor = self.db.execute(
+                f"UPDATE jobs SET status = ?, result = ?, error = ?, error_type = ?, finished = ? "
+                f"WHERE id = ? AND status IN ({placeholders})",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, error_type, time.time(), job_id) + tuple(only_from))
+            self.changed.notify_all()
+            return cursor.rowcount == 1
+
+    def _claim(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)).fetchone()
+                if row is not None:
+                    self.db.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (RUNNING, time.time(), row["id"]))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            if row is None:
+                self.changed.wait(config.JOB_POLL_SECONDS)
+        return row
+
+    def _work(self):
+        while True:
+            row = self._claim()
+            if row is None:
+                continue
+            try:
+                result = self.handlers[row["kind"]](json.loads(row["payload"]))
+            except Exception as e:
+                self._finish(row["id"], FAILED, error=str(e), error_type=type(e).__name__)
+            else:
+                if result:
+                    self._finish(row["id"], DONE, result=result)
+                else:
+                    # An empty answer is a failed call: it must not be reused by later submissions
+                    self._finish(row["id"], FAILED, error="No response from the language model.",
+                                 error_type="EmptyResponseError")
+
+    def _watch_timeouts(self):
+        while True:
+            time.sleep(1)
+            with self.lock:
+                now = time.time()
+                cursor = self.db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished = ? "
+                    "WHERE (status = ? AND started + timeout < ?) OR (status = ? AND COALESCE(queued, created) + ? < ?)",
+                    (TIMEOUT, "Timed out.", now, RUNNING, now, QUEUED, config.JOB_QUEUE_TIMEOUT, now))
+                if cursor.rowcount:
+                    self.changed.notify_all()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    #### ------- Process-wide job queue shared by all Streamlit sessions -------###
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
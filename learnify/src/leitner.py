@@ -0,0 +1,177 @@
+import hashlib
+import heapq
+import json
+import os
+import threading
+import time
+
+import agents
+import config
+
+
+## ------------------ Leitner-box review scheduler --------------###
+#
+# Every (student, original question, Bloom level) item sits in a box; new items start in box 1.
+# A score at or above agents.THRESHOLD promotes it one box, anything lower sends it back to box 1.
+# The box sets the delay before the next review. Each student has a heap of pending reviews
+# ordered by due date: re-scheduled items push a new entry and the old one is skipped lazily
+# when it reaches the top. State is persisted per student, so recording a submission rewrites only
+# that student's file.
+
+DAY = 24 * 60 * 60
+
+
+def student_file(directory, student):
+    # Hashed: student IDs are free text typed in the sidebar
+    return os.path.join(directory, hashlib.sha256(student.encode("utf-8")).hexdigest()[:32] + ".json")
+
+
+class LeitnerScheduler:
+    def __init__(self, box_intervals=config.LEITNER_BOX_INTERVALS, threshold=agents.THRESHOLD):
+        self.box_intervals = box_intervals
+        self.threshold = threshold
+        self.items = {}        # (student, question, level) -> [box, due, version]
+        self.queues = {}       # student -> heap of (due, version, key)
+        self.box_counts = {}   # student -> {level: {box: count}}
+        self.student_items = {}  # student -> keys of the student's items
+        self.submissions = {}  # student -> IDs of the scored submissions already recorded
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def _schedule(self, key, box, due):
+        student, _, level = key
+        counts = self.box_counts.setdefault(student, {}).setdefault(level, {})
+        if key in self.items:
+            old_box = self.items[key][0]
+            counts[old_box] -= 1
+            if not counts[old_box]:
+                del counts[old_box]
+        else:
+            self.student_items.setdefault(student, set()).add(key)
+        counts[box] = counts.get(box, 0) + 1
+
+        self.version += 1
+        self.items[key] = [box, due, self.version]
+        queue = self.queues.setdefault(student, [])
+        heapq.heappush(queue, (due, self.version, key))
+        # Superseded entries are dropped once they outnumber the live ones
+        if len(queue) > 2 * len(self.student_items[student]) + 64:
+            queue[:] = [entry for entry in queue if self.items[entry[2]][2] == entry[1]]
+            heapq.heapify(queue)
+
+    def record(self, student, question, level, score, now=None):
+        #### ------- Moves one item between boxes according to its latest score -------###
+        now = time.time() if now is None else now
+        key = (student, question, level)
+        with self.lock:
+            box = self.items[key][0] if key in self.items else 1
+            if score >= self.threshold:
+                box = min(box + 1, len(self.box_intervals))
+            else:
+                box = 1
+            self._schedule(key, box, now + self.box_intervals[box - 1] * DAY)
+            return box
+
+    def record_evaluation(self, student, scored_data, submission_id, now=None):
+        #### ------- Records every scored sub-question of a submission, once per submission_id -------###
+        with self.lock:
+            recorded = self.submissions.setdefault(student, set())
+            if submission_id in recorded:
+                return False
+            recorded.add(submission_id)
+        for level, sub_questions in scored_data.get("Bloom Taxonomy", {}).items():
+            for sub_question in sub_questions:
+                score = sub_question.get("Sub-Question", {}).get("score", 0)
+                self.record(student, sub_question.get("Original Question"), level, score, now)
+        return True
+
+    def _top(self, queue):
+        # Drops heap entries superseded by a later record() for the same item
+        while queue:
+            due, version, key = queue[0]
+            if self.items[key][2] == version:
+                return queue[0]
+            heapq.heappop(queue)
+        return None
+
+    def due(self, student, now=None, limit=None):
+        #### ------- The student's items due at `now`, earliest first; O(k log n) for k returned items -------###
+        now = time.time() if now is None else now
+        popped = []
+        with self.lock:
+            queue = self.queues.get(student, [])
+            while limit is None or len(popped) < limit:
+                top = self._top(queue)
+                if top is None or top[0] > now:
+                    break
+                popped.append(heapq.heappop(queue))
+            # Looking is not reviewing: entries go back until the item is recorded again
+            for entry in popped:
+                heapq.heappush(queue, entry)
+        return [key for _, _, key in popped]
+
+    def next_due_date(self, student):
+        with self.lock:
+            top = self._top(self.queues.get(student, []))
+        return top[0] if top else None
+
+    def summary(self, student, now=None, max_due=10):
+        #### ------- Compact per-level view fed to the metacognition prompts -------###
+        now = time.time() if now is None else now
+        due_items = self.due(student, now)
+        with self.lock:
+            levels = {level: {"boxes": dict(counts), "due_now": 0}
+                      for level, counts in self.box_counts.get(student, {}).items()}
+        for _, _, level in due_items:
+            levels[level]["due_now"] += 1
+        next_due = self.next_due_date(student)
+        return {
+            "Leitner Boxes": levels,
+            "Due For Review": [{"Original Question": question, "Level": level}
+                               for _, question, level in due_items[:max_due]],
+            "Next Review In Days": round(max(0.0, next_due - now) / DAY, 1) if next_due is not None else None,
+        }
+
+    def save(self, directory, student):
+        #### ------- Writes one student's items and recorded submissions: O(that student's items) -------###
+        os.makedirs(directory, exist_ok=True)
+        path = student_file(directory, student)
+        with self.lock:
+            data = {
+                "student": student,
+                "items": [[question, level] + self.items[(student, question, level)][:2]
+                          for _, question, level in self.student_items.get(student, ())],
+                "submissions": sorted(self.submissions.get(student, ())),
+            }
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding=config.ENCODING) as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def load(self, directory):
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(directory, name), 'r', encoding=config.ENCODING) as f:
+                data = json.load(f)
+            student = data["student"]
+            with self.lock:
+                for question, level, box, due in data.get("items", []):
+                    self._schedule((student, question, level), box, due)
+                self.submissions.setdefault(student, set()).update(data.get("submissions", []))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(directory=config.LEITNER_STATE_DIR):
+    #### ------- Process-wide scheduler shared by all Streamlit sessions -------###
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LeitnerScheduler()
+            _scheduler.load(directory)
+        return _scheduler
@@ -3,6 +3,8 @@ import sys
 import keys
 import tokenization 
 import config
+import dedup
+import json
 
 from langchain.document_loaders import TextLoader
 from langchain.indexes import VectorstoreIndexCreator
@@ -12,6 +14,30 @@ from langchain.chat_models import ChatOpenAI
 from langchain.chains import RetrievalQA
 
 
+def make_chat(model_name=config.MODEL_NAME):
+    #### ------- Chat model whose requests give up in time, so a hung call cannot hold a worker forever -------###
+    return ChatOpenAI(model_name=model_name, temperature=0,
+                      request_timeout=config.REQUEST_TIMEOUT, max_retries=config.REQUEST_RETRIES)
+
+
+def make_embeddings():
+    return OpenAIEmbeddings(request_timeout=config.REQUEST_TIMEOUT, max_retries=config.REQUEST_RETRIES)
+
+
+class EmptyResponseError(Exception):
+    pass
+
+
+def strip_code_block(result_str):
+    #### ------- Removes the ```json ... ``` markers the model sometimes adds -------###
+    result_str = result_str.strip()
+    if result_str.startswith("```json") and result_str.endswith("```"):
+        result_str = result_str[7:-3].strip()
+    elif result_str.startswith("```") and result_str.endswith("```"):
+        result_str = result_str[3:-3].strip()
+    return result_str
+
+
 class DocumentManager:
     #### --------- Handles loading and chunking of text  ------###
 
@@ -30,16 +56,34 @@ class DocumentManager:
         #### ------- Splits the text into chunks -------### 
         self.chunks = self.tokenizer.creat_chunks(self.text, max_tokens)
 
+    def chunk_sources(self):
+        #### ------- "<file>:<line>" where each chunk starts, to attribute retrieved chunks -------###
+        # The chunks are consecutive slices of the text: counting their newlines gives each start line
+        name = os.path.basename(self.filename)
+        sources = []
+        line = 1
+        for chunk in self.chunks:
+            # Leading blank lines belong to the previous paragraph
+            start_line = line + chunk.count("\n", 0, len(chunk) - len(chunk.lstrip()))
+            sources.append(f"{name}:{start_line}")
+            line += chunk.count("\n")
+        return sources
+
 
 class ChunkStore:
-    def __init__(self, chunks):
+    def __init__(self, chunks, sources=None):
         self.chunks = chunks
+        self.sources = sources
         self.vectorestore = None
 
     def store_chunks(self):
-        #### ------- stores the text chunks in a vector database -------###
-        texts = [chunk for chunk in self.chunks]
-        self.vectorstore = Chroma.from_texts(texts=texts, embedding=OpenAIEmbeddings())
+        #### ------- stores the text chunks in a vector database, embedding each distinct chunk once -------###
+        texts, references = dedup.deduplicate(self.chunks, self.sources)
+        # Every copy stays attributed: sources/positions of all duplicates ride along as metadata
+        metadatas = [{"sources": json.dumps(sorted({str(source) for source, _ in refs})),
+                      "positions": json.dumps([position for _, position in refs]),
+                      "copies": len(refs)} for refs in references]
+        self.vectorstore = Chroma.from_texts(texts=texts, embedding=make_embeddings(), metadatas=metadatas)
 
     def retrieve_top_n_chunks(self, question, n=3):
          #### ------- Retrieves the top n relevant chunks for a given question -------###
@@ -51,21 +95,28 @@ class ChunkStore:
     
     
 class QueryRunner:
-    def __init__(self, document_path, model_name=config.MODEL_NAME):
+    def __init__(self, document_path, model_name=config.MODEL_NAME, retriever=None):
         self.document_path = document_path
         self.model_name = model_name
+        self.retriever = retriever
 
     def run_query(self, query):
+        if self.retriever is not None:
+            #### ------- Pre-built retriever (e.g. the shared mapped index): no re-embedding -------###
+            llm = make_chat(self.model_name)
+            qa_chain = RetrievalQA.from_chain_type(llm, retriever=self.retriever)
+            return qa_chain({"query": query})
+
         document_manager = DocumentManager(self.document_path)
         document_manager.load_document()
         document_manager.split_text()
         
-        chunk_store = ChunkStore(document_manager.chunks)
+        chunk_store = ChunkStore(document_manager.chunks, document_manager.chunk_sources())
         chunk_store.store_chunks()
 
         chunk_store.retrieve_top_n_chunks(query)
 
-        llm = ChatOpenAI(model_name=self.model_name, temperature=0)
+        llm = make_chat(self.model_name)
         retriever = chunk_store.vectorstore.as_retriever()
         qa_chain = RetrievalQA.from_chain_type(llm, retriever=retriever)
         response = qa_chain({"query": query})
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+from urllib.parse import urlencode, urlsplit
+
+import config
+
+## ------------------ Concurrency load test for the FastAPI service --------------###
+#
+# Usage (from src/):
+#   python loadtest.py --concurrency 1,5,10,20 --duration 10
+#   python loadtest.py --url http://127.0.0.1:8000 --concurrency 10,50
+#
+# Without --url the app in main.py is driven in-process, on the same event loop, with stub LLM and
+# embedding backends: no OpenAI key is needed and event-loop lag is the server's own. Chunking still
+# uses tiktoken, which downloads cl100k_base on first use (set TIKTOKEN_CACHE_DIR to run offline).
+# Every request gets a unique query by default, so identical in-flight queries are not coalesced and
+# the stages measure capacity; --query-mode shared replays the query mix as is and the in-process mode
+# reports how many requests were coalesced into another one's backend call.
+# Each stage appends one JSON line to --output so runs can be compared over time.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUERIES = [
+    "What is a eukaryotic cell?",
+    "Explain the difference between smooth and rough endoplasmic reticulum.",
+    "What is a mechanical wave?",
+    "How is the propagation speed of a wave defined?",
+    "Give an example of a longitudinal wave.",
+]
+LAG_INTERVAL = 0.01
+
+
+## ------------------ Stub backends --------------###
+
+class CallCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def increment(self):
+        with self.lock:
+            self.count += 1
+
+
+# Stub LLM calls made so far (they run on threadpool threads)
+stub_llm_calls = CallCounter()
+
+
+class StubEmbeddings:
+    #### --------- Deterministic hash-based vectors, same interface as OpenAIEmbeddings ------###
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def embed_query(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [(digest[i % len(digest)] - 128) / 128.0 for i in range(self.dim)]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def make_stub_chat(latency):
+    from langchain.llms.base import LLM
+
+    class StubLLM(LLM):
+        #### --------- Answers after a fixed delay, like a remote model would ------###
+        delay: float = latency
+
+        @property
+        def _llm_type(self):
+            return "stub"
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            stub_llm_calls.increment()
+            time.sleep(self.delay)
+            return "Stub answer."
+
+    def stub_chat(model_name=None, temperature=0, **kwargs):
+        return StubLLM()
+
+    return stub_chat
+
+
+def load_app_with_stubs(llm_latency, document_path):
+    #### ------- Imports main.py with the LLM and embedding backends replaced -------###
+    if "keys" not in sys.modules:
+        sys.modules["keys"] = types.SimpleNamespace(key="stub")
+
+    import llm
+
+    llm.ChatOpenAI = make_stub_chat(llm_latency)
+    llm.make_embeddings = StubEmbeddings
+
+    # main.py serves static/ relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="learnify_loadtest_")
+    config.DOCUMENT_PATH = os.path.abspath(document_path)
+    config.INDEX_PATH = os.path.join(workdir, "loadtest.idx")
+    os.chdir(os.path.dirname(SRC_DIR))
+
+    import main
+    return main.app
+
+
+## ------------------ Clients --------------###
+
+class InProcessClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def get(self, path, params):
+        query_string = urlencode(params)
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query_string.encode(), "root_path": "",
+            "headers": [(b"host", b"loadtest")],
+            "client": ("127.0.0.1", 0), "server": ("loadtest", 80),
+        }
+        status = None
+        request_sent = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            disconnected.set()
+        return status
+
+
+class HTTPClient:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+
+    async def get(self, path, params):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            request = (f"GET {path}?{urlencode(params)} HTTP/1.1\r\n"
+                       f"Host: {self.host}:{self.port}\r\nConnection: close\r\n\r\n")
+            writer.write(request.encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
+
+
+## ------------------ Measurements --------------###
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    # Nearest-rank percentile
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[rank]
+
+
+async def monitor_loop_lag(lags, stop):
+    #### ------- How late a short sleep wakes up = how long the loop was blocked -------###
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+
+async def run_stage(client, concurrency, duration, queries, rng, unique=True, count_calls=False):
+    latencies = []
+    errors = 0
+    lags = []
+    sent = 0
+    stop = asyncio.Event()
+    deadline = time.perf_counter() + duration
+    calls_before = stub_llm_calls.count
+
+    async def worker():
+        nonlocal errors, sent
+        while time.perf_counter() < deadline:
+            query = rng.choice(queries)
+            sent += 1
+            if unique:
+                # Defeats single-flight coalescing: every request is a distinct backend call
+                query = f"{query} (#{sent})"
+            start = time.perf_counter()
+            try:
+                status = await client.get("/query", {"query": query})
+                if status != 200:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    lag_task = asyncio.create_task(monitor_loop_lag(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    requests = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed > 0 else 0,
+        "latency_ms": {"p50": ms(percentile(latencies, 50)), "p95": ms(percentile(latencies, 95)),
+                       "p99": ms(percentile(latencies, 99)), "max": ms(max(latencies, default=None))},
+        "loop_lag_ms": {"p99": ms(percentile(lags, 99)), "max": ms(max(lags, default=None))},
+        # Share of requests answered by another request's backend call (in-process only)
+        "coalesced_fraction": (round(1 - (stub_llm_calls.count - calls_before) / requests, 4)
+                               if count_calls and requests else None),
+    }
+
+
+async def run(args):
+    if args.url:
+        client = HTTPClient(args.url)
+        mode = "http"
+    else:
+        client = InProcessClient(load_app_with_stubs(args.llm_latency, args.document))
+        mode = "in-process"
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, 'r', encoding=config.ENCODING) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    rng = random.Random(args.seed)
+    run_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    results = []
+    for concurrency in args.concurrency:
+        stage = await run_stage(client, concurrency, args.duration, queries, rng,
+                                unique=args.query_mode == "unique", count_calls=not args.url)
+        stage.update({"run_id": run_id, "mode": mode, "duration_s": args.duration,
+                      "llm_latency_s": None if args.url else args.llm_latency, "queries": len(queries),
+                      "query_mode": args.query_mode})
+        results.append(stage)
+        print(f"c={concurrency:<4} rps={stage['throughput_rps']:<8} "
+              f"p50={stage['latency_ms']['p50']}ms p95={stage['latency_ms']['p95']}ms "
+              f"p99={stage['latency_ms']['p99']}ms errors={stage['error_rate']:.2%} "
+              f"lag_p99={stage['loop_lag_ms']['p99']}ms"
+              + (f" coalesced={stage['coalesced_fraction']:.2%}" if stage['coalesced_fraction'] is not None else ""))
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrency load test for the Learnify FastAPI service")
+    parser.add_argument("--url", help="Base URL of a running server; in-process with stub backends if omitted")
+    parser.add_argument("--concurrency", default="1,5,10,20",
+                        type=lambda value: [int(c) for c in value.split(",")],
+                        help="Comma separated concurrency ramp, one stage per value")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per stage")
+    parser.add_argument("--queries", help="File with one query per line (default: built-in mix)")
+    parser.add_argument("--query-mode", choices=["unique", "shared"], default="unique",
+                        help="unique: a per-request suffix makes every query distinct (capacity); "
+                             "shared: replay the mix as is (includes single-flight coalescing)")
+    parser.add_argument("--document", default=os.path.join(SRC_DIR, "..", "data", "physics", "exo.txt"),
+                        help="Corpus indexed by the in-process app")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub LLM response time in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest_results.jsonl", help="JSON lines file results are appended to")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # The in-process mode changes directory to serve static/: resolve paths first
+    args.output = os.path.abspath(args.output)
+    if args.queries:
+        args.queries = os.path.abspath(args.queries)
+    results = asyncio.run(run(args))
+    with open(args.output, 'a', encoding=config.ENCODING) as f:
+        for stage in results:
+            f.write(json.dumps(stage) + "\n")
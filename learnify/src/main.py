@@ -1,8 +1,15 @@
 
+from fastapi import FastAPI, Query
+from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
 import config
 import llm
 import keys
 import os
+import singleflight
+import vectorindex
 
 import sys
 import os
@@ -13,6 +20,13 @@ sys.path.append(os.path.abspath(os.path.join(os.getcwd(), "../..")))
 app = FastAPI()
 os.environ["OPENAI_API_KEY"] = keys.key
 
+#### --------- Every worker maps the same on-disk index: one physical copy, embedded only once ------------------ ####
+shared_index = vectorindex.open_or_build(config.DOCUMENT_PATH, config.INDEX_PATH, quantization=config.INDEX_QUANTIZATION)
+shared_retriever = vectorindex.MappedRetriever(index=shared_index, embedding=llm.make_embeddings())
+
+#### --------- Identical concurrent queries are coalesced on the event loop: only one threadpool slot per query ------------------ ####
+async_query_flight = singleflight.AsyncSingleFlight()
+
 #### --------- Mounting static files to be served at the "/static" endpoint ------------------ ####
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -24,10 +38,11 @@ async def read_root():
 @app.get("/query")
 async def get_query_response(query: str = Query(..., description="Enter your query here")):
     #### ------Creating a QueryRunner object with the document path and model name --------------####
-    query_runner = llm.QueryRunner(document_path = config.DOCUMENT_PATH ,model_name=config.MODEL_NAME)
+    query_runner = llm.QueryRunner(document_path = config.DOCUMENT_PATH ,model_name=config.MODEL_NAME, retriever=shared_retriever)
 
-    #### ------ Running the query and getting the response ------------------####
-    response = query_runner.run_query(query)
+    #### ------ Running the query and getting the response (identical concurrent queries share one run) ------------------####
+    flight_key = singleflight.make_key("query", config.MODEL_NAME, config.DOCUMENT_PATH, query)
+    response = await async_query_flight.do(flight_key, run_in_threadpool, query_runner.run_query, query)
 
     #### --------  Returning the response as a JSON object -------- ####
     return {"response": response}
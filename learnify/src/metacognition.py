@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+import agents
+import config
+import llm
+
+
+## ------------------ Dual-audience metacognitive recommendations --------------###
+#
+# The teacher and student variants are generated as separate jobs from the same evaluation input.
+# Deduplication is left to the job queue: identical requests attach to the queued/running job with the
+# same inputs, and finished results are reused until they are dropped after JOB_RETENTION_DAYS.
+
+AUDIENCE_PROMPTS = {
+    "teacher": agents.METACOGNITION_AGENT_PROMPT_TEACHER,
+    "student": agents.METACOGNITION_AGENT_PROMPT_STUDENT,
+}
+
+
+def _run_prompt(prompt, model_name):
+    # Same RAG call as the other agents: the prompt itself is the indexed document
+    with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding=config.ENCODING, suffix=".txt") as tmp_file:
+        tmp_file.write(prompt)
+        temp_file_path = tmp_file.name
+
+    try:
+        metacognition_agent = llm.QueryRunner(document_path=temp_file_path, model_name=model_name)
+        return metacognition_agent.run_query(prompt).get('result', '').strip()
+    finally:
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+
+def generate(audience, input_json_str, model_name=config.MODEL_NAME):
+    #### ------- Recommendations for one audience -------###
+    prompt = AUDIENCE_PROMPTS[audience].replace("{input_json}", input_json_str)
+    return _run_prompt(prompt, model_name)
+
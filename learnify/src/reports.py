@@ -0,0 +1,149 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import config
+
+
+## ------------------ Background report rendering --------------###
+#
+# PDF reports (Bloom-level chart + scores + recommendations) are rendered in a process pool so
+# matplotlib/fpdf never run in the Streamlit script thread. Each report is cached on disk under a
+# hash of its inputs: the UI submits, then polls for the finished file, and an unchanged report
+# is never rendered twice.
+
+def report_key(student, taxonomy_evaluation, recommendations):
+    payload = json.dumps([student, taxonomy_evaluation, recommendations], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _latin1(text):
+    # fpdf core fonts only cover latin-1
+    return str(text).encode("latin-1", "replace").decode("latin-1")
+
+
+def render_report(path, student, taxonomy_evaluation, recommendations):
+    #### ------- Runs in a worker process: draws the chart and writes the PDF -------###
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from fpdf import FPDF
+
+    levels = list(taxonomy_evaluation.get("Bloom Taxonomy", {}).items())
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_chart:
+        chart_path = tmp_chart.name
+
+    try:
+        fig, ax = plt.subplots(figsize=(7, 3.5))
+        ax.bar([level for level, _ in levels], [stats.get("average_score", 0) for _, stats in levels], color="#0d6efd")
+        ax.set_ylim(0, 5)
+        ax.set_ylabel("Average score (/5)")
+        ax.set_title("Bloom Taxonomy levels")
+        fig.tight_layout()
+        fig.savefig(chart_path, dpi=150)
+        plt.close(fig)
+
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 16)
+        pdf.cell(0, 10, _latin1(f"Learnify progress report - {student}"), ln=1)
+        pdf.image(chart_path, w=180)
+
+        pdf.set_font("Arial", "B", 11)
+        for header, width in (("Level", 50), ("Average", 40), ("Weight", 40), ("Weighted", 40)):
+            pdf.cell(width, 8, header, border=1)
+        pdf.ln()
+        pdf.set_font("Arial", "", 11)
+        total_weighted_score = 0.0
+        for level, stats in levels:
+            total_weighted_score += stats.get("weighted_average", 0)
+            pdf.cell(50, 8, level, border=1)
+            pdf.cell(40, 8, f"{stats.get('average_score', 0):.2f}", border=1)
+            pdf.cell(40, 8, f"{stats.get('weight', 0):.2f}", border=1)
+            pdf.cell(40, 8, f"{stats.get('weighted_average', 0):.2f}", border=1)
+            pdf.ln()
+        pdf.cell(0, 8, f"Total weighted average score: {total_weighted_score:.2f} out of 5.00", ln=1)
+
+        # recommendations is {audience: text}, one section per audience
+        for audience, text in (recommendations or {}).items():
+            pdf.ln(4)
+            pdf.set_font("Arial", "B", 13)
+            pdf.cell(0, 10, f"Metacognitive Recommendations - {audience.capitalize()}", ln=1)
+            pdf.set_font("Arial", "", 11)
+            pdf.multi_cell(0, 6, _latin1(text))
+
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        pdf.output(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(chart_path):
+            os.unlink(chart_path)
+    return path
+
+
+class ReportRenderer:
+    def __init__(self, reports_dir=config.REPORTS_DIR, max_workers=config.REPORT_WORKERS):
+        self.reports_dir = reports_dir
+        os.makedirs(reports_dir, exist_ok=True)
+        # spawn, not fork: the Streamlit process already runs job-queue threads holding locks
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.reports_dir, f"report_{key}.pdf")
+
+    def submit(self, student, taxonomy_evaluation, recommendations):
+        #### ------- Queues a report unless it is already rendered or rendering; returns its key -------###
+        key = report_key(student, taxonomy_evaluation, recommendations)
+        with self.lock:
+            if os.path.exists(self.path(key)):
+                return key
+            future = self.futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                self.futures[key] = self.executor.submit(
+                    render_report, self.path(key), student, taxonomy_evaluation, recommendations
+                )
+        return key
+
+    def submit_class(self, reports):
+        #### ------- Queues a whole class: reports is an iterable of (student, evaluation, recommendations) -------###
+        return [self.submit(student, evaluation, recommendations) for student, evaluation, recommendations in reports]
+
+    def status(self, key):
+        #### ------- "done", "pending", "failed" or "unknown" -------###
+        if os.path.exists(self.path(key)):
+            return "done"
+        with self.lock:
+            future = self.futures.get(key)
+        if future is None:
+            return "unknown"
+        if not future.done():
+            return "pending"
+        return "failed" if future.exception() is not None else "done"
+
+    def wait(self, keys, timeout):
+        #### ------- Blocks until the given reports are finished or `timeout` seconds pass -------###
+        with self.lock:
+            futures = [self.futures[key] for key in keys if key in self.futures]
+        wait(futures, timeout=timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    #### ------- Process-wide renderer shared by all Streamlit sessions -------###
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = ReportRenderer()
+        return _renderer
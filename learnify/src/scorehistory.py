@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+
+
+## ------------------ Incremental per-student score history --------------###
+#
+# For each (student, Bloom level) we keep running aggregates only: submission count, score sum,
+# an exponentially-decayed mean and a smoothed trend (decayed average of how far each new
+# submission lands from the previous decayed mean). A new scored submission updates them in O(1);
+# past submission files are never read again, and only the student's own state file is rewritten.
+
+def student_file(directory, student):
+    # Hashed: student IDs are free text typed in the sidebar
+    return os.path.join(directory, hashlib.sha256(student.encode("utf-8")).hexdigest()[:32] + ".json")
+
+
+class LevelAggregate:
+    def __init__(self, count=0, total=0.0, ema=None, trend=0.0, last_score=None, last_updated=None):
+        self.count = count
+        self.total = total
+        self.ema = ema
+        self.trend = trend
+        self.last_score = last_score
+        self.last_updated = last_updated
+
+    def update(self, score, now, alpha=config.SCORE_EMA_ALPHA):
+        if self.ema is None:
+            self.ema = score
+        else:
+            self.trend = alpha * (score - self.ema) + (1 - alpha) * self.trend
+            self.ema = alpha * score + (1 - alpha) * self.ema
+        self.count += 1
+        self.total += score
+        self.last_score = score
+        self.last_updated = now
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+
+class ScoreHistory:
+    def __init__(self, alpha=config.SCORE_EMA_ALPHA):
+        self.alpha = alpha
+        self.students = {}  # student -> {level: LevelAggregate}
+        self.submissions = {}  # student -> IDs of the scored submissions already recorded
+        self.lock = threading.Lock()
+
+    def record_submission(self, student, scored_data, submission_id, now=None):
+        #### ------- Folds one scored submission into the student's per-level aggregates, once per submission_id -------###
+        now = time.time() if now is None else now
+        with self.lock:
+            recorded = self.submissions.setdefault(student, set())
+            if submission_id in recorded:
+                return False
+            recorded.add(submission_id)
+            levels = self.students.setdefault(student, {})
+            for level, sub_questions in scored_data.get("Bloom Taxonomy", {}).items():
+                if not sub_questions:
+                    continue
+                scores = [sub_question.get("Sub-Question", {}).get("score", 0) for sub_question in sub_questions]
+                aggregate = levels.setdefault(level, LevelAggregate())
+                aggregate.update(sum(scores) / len(scores), now, self.alpha)
+            return True
+
+    def progress_summary(self, student):
+        #### ------- Longitudinal view of one student, fed to the metacognition prompts -------###
+        with self.lock:
+            levels = self.students.get(student, {})
+            return {
+                level: {
+                    "submissions": aggregate.count,
+                    "mean_score": round(aggregate.mean(), 2),
+                    "recent_score": round(aggregate.ema, 2),
+                    "trend": round(aggregate.trend, 2),
+                    "last_score": round(aggregate.last_score, 2),
+                }
+                for level, aggregate in levels.items()
+            }
+
+    def save(self, directory, student):
+        #### ------- Writes one student's aggregates and recorded submissions -------###
+        os.makedirs(directory, exist_ok=True)
+        path = student_file(directory, student)
+        with self.lock:
+            data = {
+                "student": student,
+                "levels": {level: vars(aggregate) for level, aggregate in self.students.get(student, {}).items()},
+                "submissions": sorted(self.submissions.get(student, ())),
+            }
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding=config.ENCODING) as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def load(self, directory):
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(directory, name), 'r', encoding=config.ENCODING) as f:
+                data = json.load(f)
+            student = data["student"]
+            with self.lock:
+                self.students[student] = {level: LevelAggregate(**aggregate)
+                                          for level, aggregate in data.get("levels", {}).items()}
+                self.submissions[student] = set(data.get("submissions", []))
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history(directory=config.SCORE_HISTORY_DIR):
+    #### ------- Process-wide score history shared by all Streamlit sessions -------###
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = ScoreHistory()
+            _history.load(directory)
+        return _history
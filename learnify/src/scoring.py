@@ -0,0 +1,32 @@
+import json
+import os
+import tempfile
+
+import agents
+import config
+import llm
+
+
+## ------------------ Scoring agent --------------###
+
+def score_answers(restructured_data, model_name=config.MODEL_NAME):
+    #### ------- Runs the scoring prompt on the restructured answers and returns the scored JSON -------###
+    input_json = json.dumps(restructured_data, ensure_ascii=False, indent=4)
+    scoring_prompt = agents.SCORING_AGENT_PROMPT.replace("{input_json}", input_json)
+
+    # Write the input JSON to a temporary file
+    with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding=config.ENCODING, suffix=".json") as tmp_file:
+        tmp_file.write(input_json)
+        temp_file_path = tmp_file.name
+
+    try:
+        scoring_agent = llm.QueryRunner(document_path=temp_file_path, model_name=model_name)
+        scoring_response = scoring_agent.run_query(scoring_prompt)
+    finally:
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+    result_str = llm.strip_code_block(scoring_response.get('result', ''))
+    if not result_str:
+        raise llm.EmptyResponseError("No response from the language model.")
+    return json.loads(result_str)
@@ -0,0 +1,34 @@
+import asyncio
+import hashlib
+
+
+## ------------------ Single-flight request coalescing --------------###
+
+def make_key(*parts):
+    #### ------- Builds a stable hash key from the content / prompt / model of a request -------###
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class AsyncSingleFlight:
+    #### --------- Concurrent calls with the same key share one task: followers await it, no thread each ------###
+
+    def __init__(self):
+        self.tasks = {}
+
+    async def do(self, key, async_fn, *args, **kwargs):
+        #### ------- Awaits async_fn once per key; only the leader's coroutine (e.g. run_in_threadpool) runs -------###
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(async_fn(*args, **kwargs))
+            self.tasks[key] = task
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+        # Shielded: a client disconnecting does not cancel the work the other requests wait on
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self.tasks)
+
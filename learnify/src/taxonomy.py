@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import llm
+import tokenization
+
+
+## ------------------ Parallel chunked taxonomy generation --------------###
+
+def is_heading(block):
+    # A single line without a question mark, e.g. "Exercice 1 : Définition et Types d'Ondes"
+    return "\n" not in block.strip() and "?" not in block
+
+
+def split_questions(text):
+    #### ------- Splits an upload into question blocks (separated by blank lines) -------###
+    blocks = []
+    current = []
+    for line in text.splitlines():
+        if line.strip():
+            current.append(line)
+        elif current:
+            blocks.append("\n".join(current))
+            current = []
+    if current:
+        blocks.append("\n".join(current))
+
+    # Headings stay with the questions that follow them, so no group is only a title
+    merged = []
+    pending_headings = []
+    for block in blocks:
+        if is_heading(block):
+            pending_headings.append(block)
+            continue
+        merged.append("\n\n".join(pending_headings + [block]))
+        pending_headings = []
+    if pending_headings:
+        if merged:
+            merged[-1] = "\n\n".join([merged[-1]] + pending_headings)
+        else:
+            merged.append("\n\n".join(pending_headings))
+    return merged
+
+
+def split_block(block, tokenizer, max_tokens=config.TAXONOMY_GROUP_TOKENS):
+    #### ------- Cuts a block over budget into line-aligned pieces (one question per line banks) -------###
+    if tokenizer.count_tokens(block) <= max_tokens:
+        return [block]
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in block.splitlines():
+        line_tokens = tokenizer.count_tokens(line)
+        if line_tokens > max_tokens:
+            # A single line over budget is cut on token boundaries
+            tokens = tokenizer.tt_encoding.encode(line)
+            lines = [tokenizer.tt_encoding.decode(tokens[start:start + max_tokens])
+                     for start in range(0, len(tokens), max_tokens)]
+        else:
+            lines = [line]
+        for piece in lines:
+            piece_tokens = tokenizer.count_tokens(piece) + 1  # + the newline joining it
+            if current and current_tokens + piece_tokens > max_tokens:
+                pieces.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def group_questions(blocks, tokenizer, max_tokens=config.TAXONOMY_GROUP_TOKENS):
+    #### ------- Packs consecutive blocks into groups that stay under the token budget -------###
+    separator_tokens = tokenizer.count_tokens("\n\n")
+    groups = []
+    current = []
+    current_tokens = 0
+    for block in blocks:
+        # Blocks over budget are split first, so no group exceeds max_tokens and no question is dropped
+        for piece in split_block(block, tokenizer, max_tokens - separator_tokens):
+            piece_tokens = tokenizer.count_tokens(piece) + separator_tokens
+            if current and current_tokens + piece_tokens > max_tokens:
+                groups.append("\n\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+
+class TaxonomyGenerator:
+    def __init__(self, model_name=config.MODEL_NAME, max_tokens=config.TAXONOMY_GROUP_TOKENS,
+                 max_workers=config.TAXONOMY_WORKERS):
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.max_workers = max_workers
+        self.tokenizer = tokenization.TextTokenizer()
+
+    def generate_group(self, group, prompt):
+        #### ------- Runs the taxonomy prompt on one question group and returns its "Topic Questions" -------###
+        with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding=config.ENCODING, suffix=".txt") as tmp_file:
+            tmp_file.write(group)
+            temp_file_path = tmp_file.name
+
+        try:
+            query_runner = llm.QueryRunner(document_path=temp_file_path, model_name=self.model_name)
+            response = query_runner.run_query(prompt)
+        finally:
+            if os.path.exists(temp_file_path):
+                os.unlink(temp_file_path)
+
+        result_str = llm.strip_code_block(response.get('result', ''))
+        if not result_str:
+            raise llm.EmptyResponseError("No response from the language model.")
+        return json.loads(result_str).get("Topic Questions", [])
+
+    def generate(self, text, prompt):
+        #### ------- Generates every group concurrently and merges them back in upload order -------###
+        groups = group_questions(split_questions(text), self.tokenizer, self.max_tokens)
+        if not groups:
+            return []
+
+        workers = min(self.max_workers, len(groups))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda group: self.generate_group(group, prompt), groups))
+
+        topic_questions = []
+        for questions in results:
+            topic_questions.extend(questions)
+        return topic_questions
@@ -0,0 +1,347 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Any, List
+
+import numpy as np
+from langchain.schema import BaseRetriever, Document
+
+import config
+import dedup
+import llm
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+## ------------------ Memory-mapped shared vector index --------------###
+#
+# File layout (little endian):
+#   header       : magic, number of chunks, dimension, size of the text blob, size of the references blob
+#   vectors      : float32 matrix (n x dim), rows L2-normalized
+#   offsets      : int64 array (n + 1), byte offsets of each chunk in the text blob
+#   ref offsets  : int64 array (n + 1), byte offsets of each chunk's references in the references blob
+#   text         : utf-8 chunk texts, concatenated
+#   references   : utf-8 JSON lists of the [source, position] of every copy of each chunk, concatenated
+
+MAGIC = b"LRNIDX02"
+HEADER = struct.Struct("<8sQQQQ")
+
+
+def _blob_offsets(encoded):
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    return offsets
+
+
+def write_index(path, chunks, vectors, references=None):
+    #### ------- Writes chunks + their embeddings + where their copies came from in one contiguous file -------###
+    # An empty corpus still gives a valid (0 x 0) index
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(chunks), -1) if chunks else np.zeros((0, 0), np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    references = references if references is not None else [[] for _ in chunks]
+    encoded = [chunk.encode("utf-8") for chunk in chunks]
+    encoded_refs = [json.dumps(refs, ensure_ascii=False).encode("utf-8") for refs in references]
+    offsets = _blob_offsets(encoded)
+    ref_offsets = _blob_offsets(encoded_refs)
+
+    # Write next to the target and rename: workers never open a half-written index
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(encoded), vectors.shape[1], int(offsets[-1]), int(ref_offsets[-1])))
+        f.write(vectors.astype("<f4").tobytes())
+        f.write(offsets.astype("<i8").tobytes())
+        f.write(ref_offsets.astype("<i8").tobytes())
+        for text in encoded:
+            f.write(text)
+        for refs in encoded_refs:
+            f.write(refs)
+    os.replace(tmp_path, path)
+
+
+class MappedIndex:
+    #### --------- Read-only view over an index file, shared by every worker through the page cache ------###
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size, self.dim, text_bytes, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a vector index file")
+
+        # Zero-copy views: nothing is read until the pages are touched
+        vectors_at = HEADER.size
+        offsets_at = vectors_at + self.size * self.dim * 4
+        ref_offsets_at = offsets_at + (self.size + 1) * 8
+        self.text_at = ref_offsets_at + (self.size + 1) * 8
+        self.refs_at = self.text_at + text_bytes
+        self.vectors = np.frombuffer(self.mm, dtype="<f4", count=self.size * self.dim,
+                                     offset=vectors_at).reshape(self.size, self.dim)
+        self.offsets = np.frombuffer(self.mm, dtype="<i8", count=self.size + 1, offset=offsets_at)
+        self.ref_offsets = np.frombuffer(self.mm, dtype="<i8", count=self.size + 1, offset=ref_offsets_at)
+
+    def chunk(self, i):
+        start = self.text_at + int(self.offsets[i])
+        end = self.text_at + int(self.offsets[i + 1])
+        return self.mm[start:end].decode("utf-8")
+
+    def references(self, i):
+        #### ------- [source, position] of every copy of chunk i in the original corpus -------###
+        start = self.refs_at + int(self.ref_offsets[i])
+        end = self.refs_at + int(self.ref_offsets[i + 1])
+        return json.loads(self.mm[start:end].decode("utf-8"))
+
+    def search(self, query_vector, n=config.TOP_N_CHUNKS):
+        #### ------- Returns the n most similar chunks as (text, cosine score, references) -------###
+        if self.size == 0:
+            return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+
+        scores = self.vectors @ query_vector
+        n = min(n, self.size)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk(i), float(scores[i]), self.references(i)) for i in top]
+
+    def close(self):
+        self.vectors = None
+        self.offsets = None
+        self.ref_offsets = None
+        self.mm.close()
+
+
+## ------------------ Quantized compact index --------------###
+#
+# Compact file layout: header (magic, number of chunks, dimension, kind), then for int8 one float32
+# scale per row followed by the int8 matrix, or for float16 the float16 matrix.
+# The full-precision index stays on disk and is only touched to re-rank the best candidates.
+
+COMPACT_MAGIC = b"LRNQNT01"
+COMPACT_HEADER = struct.Struct("<8sQQQ")
+QUANTIZATIONS = {"int8": 0, "float16": 1}
+SEARCH_BLOCK_ROWS = 65536
+
+
+def compact_path(index_path, quantization):
+    return f"{index_path}.{quantization}"
+
+
+def write_compact_index(path, vectors, quantization=config.INDEX_QUANTIZATION):
+    #### ------- Writes the quantized copy of (already normalized) vectors -------###
+    vectors = np.asarray(vectors, dtype=np.float32)
+    kind = QUANTIZATIONS[quantization]
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(COMPACT_HEADER.pack(COMPACT_MAGIC, vectors.shape[0], vectors.shape[1], kind))
+        if quantization == "int8":
+            # Symmetric per-row scale: each row uses the full [-127, 127] range
+            scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            f.write(scales.astype("<f4").tobytes())
+            f.write(quantized.tobytes())
+        else:
+            f.write(vectors.astype("<f2").tobytes())
+    os.replace(tmp_path, path)
+
+
+class CompactIndex:
+    #### --------- Searches the mapped quantized vectors, re-ranks candidates with the full-precision index ------###
+
+    def __init__(self, path, full_index, rerank_factor=config.RERANK_FACTOR):
+        self.path = path
+        self.full_index = full_index
+        self.rerank_factor = rerank_factor
+
+        # Mapped like MappedIndex: every worker shares one physical copy of the quantized matrix
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size, self.dim, kind = COMPACT_HEADER.unpack_from(self.mm, 0)
+        if magic != COMPACT_MAGIC:
+            raise ValueError(f"{path} is not a compact index file")
+        offset = COMPACT_HEADER.size
+        if kind == QUANTIZATIONS["int8"]:
+            self.scales = np.frombuffer(self.mm, dtype="<f4", count=self.size, offset=offset)
+            offset += self.size * 4
+            self.vectors = np.frombuffer(self.mm, dtype=np.int8, count=self.size * self.dim,
+                                         offset=offset).reshape(self.size, self.dim)
+        else:
+            self.scales = None
+            self.vectors = np.frombuffer(self.mm, dtype="<f2", count=self.size * self.dim,
+                                         offset=offset).reshape(self.size, self.dim)
+
+        if self.size != full_index.size or self.dim != full_index.dim:
+            raise ValueError(f"{path} does not match {full_index.path}")
+
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, query_vector):
+        # Dequantize block by block so the float32 temporary stays bounded
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, SEARCH_BLOCK_ROWS):
+            block = self.vectors[start:start + SEARCH_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ query_vector
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query_vector, n=config.TOP_N_CHUNKS):
+        #### ------- Same contract as MappedIndex.search: the n best chunks as (text, cosine score, references) -------###
+        if self.size == 0:
+            return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+
+        scores = self.approximate_scores(query_vector)
+        n = min(n, self.size)
+        n_candidates = min(self.size, n * self.rerank_factor)
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+
+        # Only the candidate rows of the full-precision file are paged in (sorted for sequential reads)
+        candidates = np.sort(candidates)
+        exact = self.full_index.vectors[candidates] @ query_vector
+        order = np.argsort(-exact)[:n]
+        return [(self.full_index.chunk(candidates[j]), float(exact[j]), self.full_index.references(candidates[j]))
+                for j in order]
+
+    def recall_check(self, n=config.TOP_N_CHUNKS, samples=200, seed=0):
+        #### ------- Mean recall@n of this index against exact search, using perturbed stored vectors as queries -------###
+        if self.size == 0:
+            return 1.0
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(self.size, size=min(samples, self.size), replace=False)
+        hits = 0
+        total = 0
+        for row in rows:
+            query_vector = self.full_index.vectors[row] + rng.normal(scale=0.05, size=self.dim).astype(np.float32)
+            expected = {text for text, _, _ in self.full_index.search(query_vector, n)}
+            found = {text for text, _, _ in self.search(query_vector, n)}
+            hits += len(expected & found)
+            total += len(expected)
+        return hits / total
+
+
+def report_recall(compact_index, n=config.TOP_N_CHUNKS):
+    #### ------- Prints memory savings and recall@n of a compact index against exact search -------###
+    recall = compact_index.recall_check(n)
+    full_bytes = compact_index.full_index.vectors.nbytes
+    ratio = full_bytes / compact_index.nbytes() if compact_index.nbytes() else 1.0
+    print(f"Compact index {compact_index.path}: {ratio:.1f}x smaller than float32, recall@{n} = {recall:.3f}")
+    return recall
+
+
+class MappedRetriever(BaseRetriever):
+    #### --------- LangChain retriever over a MappedIndex, usable by RetrievalQA ------###
+    index: Any
+    embedding: Any
+    k: int = config.TOP_N_CHUNKS
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        query_vector = self.embedding.embed_query(query)
+        # Same attribution metadata as llm.ChunkStore, so answers can cite every copy of a chunk
+        return [Document(page_content=text,
+                         metadata={"score": score,
+                                   "sources": json.dumps(sorted({str(source) for source, _ in refs})),
+                                   "positions": json.dumps([position for _, position in refs]),
+                                   "copies": len(refs)})
+                for text, score, refs in self.index.search(query_vector, self.k)]
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        return self._get_relevant_documents(query)
+
+
+def build_index(document_path, index_path, embedding=None):
+    #### ------- Chunks and embeds a document once, then writes its index file -------###
+    embedding = embedding or llm.make_embeddings()
+    document_manager = llm.DocumentManager(document_path)
+    document_manager.load_document()
+    document_manager.split_text()
+    kept = [(chunk, source) for chunk, source in zip(document_manager.chunks, document_manager.chunk_sources())
+            if chunk.strip()]
+    # Duplicated boilerplate is embedded and stored once; the references keep track of every copy
+    chunks, references = dedup.deduplicate([chunk for chunk, _ in kept], [source for _, source in kept])
+    write_index(index_path, chunks, embedding.embed_documents(chunks), references)
+
+
+def _is_current(index_path):
+    # Files written by an older layout are rebuilt rather than misread
+    with open(index_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    else:
+        # LK_LOCK retries for ~10s; keep trying while another worker builds the index
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def open_or_build(document_path, index_path, embedding=None, quantization=None):
+    #### ------- Opens the shared index, building it first if missing or older than the document -------###
+    #### ------- With a quantization ("int8" / "float16") a CompactIndex over it is returned instead -------###
+    if not os.path.exists(document_path):
+        raise FileNotFoundError(f"Corpus {os.path.abspath(document_path)} not found: "
+                                f"set config.DOCUMENT_PATH to the document the service should index")
+    # The lock makes sure only the first worker embeds the corpus; the others wait and map its file
+    with open(f"{index_path}.lock", "w") as lock_file:
+        _lock(lock_file)
+        try:
+            stale = (not os.path.exists(index_path)
+                     or os.path.getmtime(index_path) < os.path.getmtime(document_path)
+                     or not _is_current(index_path))
+            if stale:
+                build_index(document_path, index_path, embedding)
+            if quantization is not None:
+                quantized_path = compact_path(index_path, quantization)
+                # Also rebuilt when the full index was rebuilt by an open without quantization
+                if (stale or not os.path.exists(quantized_path)
+                        or os.path.getmtime(quantized_path) < os.path.getmtime(index_path)):
+                    full_index = MappedIndex(index_path)
+                    write_compact_index(quantized_path, full_index.vectors, quantization)
+                    report_recall(CompactIndex(quantized_path, full_index))
+        finally:
+            _unlock(lock_file)
+
+    full_index = MappedIndex(index_path)
+    if quantization is None:
+        return full_index
+    return CompactIndex(compact_path(index_path, quantization), full_index)
+
+
+if __name__ == "__main__":
+    # Rebuilds the shared index if needed and reports the recall of its compact copy
+    quantization = sys.argv[1] if len(sys.argv) > 1 else config.INDEX_QUANTIZATION
+    index = open_or_build(config.DOCUMENT_PATH, config.INDEX_PATH, quantization=quantization)
+    if isinstance(index, CompactIndex):
+        report_recall(index)